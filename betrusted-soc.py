@@ -7,11 +7,19 @@
 LX_DEPENDENCIES = ["riscv", "vivado"]
 
 # Import lxbuildenv to integrate the deps/ directory
+# This has to stay a plain import ahead of everything else: on the first run it checks dependencies and re-execs
+# this script (so argument parsing only ever happens in the child), and in the child it sets up sys.path for the imports below
 import lxbuildenv
 import lxsocdoc
 
 from random import SystemRandom
 import argparse
+import functools
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
 
 from migen import *
 from migen.genlib.resetsync import AsyncResetSynchronizer
@@ -38,130 +46,138 @@ from gateware import ticktimer
 from gateware import spinor
 from gateware import keyboard
 
+# Pins() splits its identifier strings every time it is built, and many entries share the same pins;
+# build each distinct Pins once
+@functools.lru_cache(maxsize=None)
+def _pins(*identifiers):
+    return Pins(*identifiers)
+
+# wide SRAM buses as pre-tokenized pin tuples
+SRAM_ADR = ("V12", "M5", "P5", "N4",  "V14", "M3", "R17", "U15",
+            "M4",  "L6", "K3", "R18", "U16", "K1", "R5",  "T2",
+            "U1",  "N1", "L5", "K2",  "M18", "T6")
+SRAM_D = tuple(
+    "M2  R4  P2  L4  L1  M1  R1  P1 "
+    "U3  V2  V4  U2  N2  T1  K6  J6 "
+    "V16 V15 U17 U18 P17 T18 P18 M17 "
+    "N3  T4  V13 P15 T14 R15 T3  R7".split())
+
 _io = [
     # see main() for UART pins
 
-    ("clk12", 0, Pins("R3"), IOStandard("LVCMOS18")),
+    ("clk12", 0, _pins("R3"), IOStandard("LVCMOS18")),
 
-    #("usbc_cc1", 0, Pins("C17"), IOStandard("LVCMOS33")), # analog
-    #("usbc_cc2", 0, Pins("E16"), IOStandard("LVCMOS33")), # analog
-    # ("vbus_div", 0, Pins("E12"), IOStandard("LVCMOS33")), # analog
-    ("lpclk", 0, Pins("N15"), IOStandard("LVCMOS18")),  # wifi_lpclk
+    #("usbc_cc1", 0, _pins("C17"), IOStandard("LVCMOS33")), # analog
+    #("usbc_cc2", 0, _pins("E16"), IOStandard("LVCMOS33")), # analog
+    # ("vbus_div", 0, _pins("E12"), IOStandard("LVCMOS33")), # analog
+    ("lpclk", 0, _pins("N15"), IOStandard("LVCMOS18")),  # wifi_lpclk
 
     # Power control signals
     ("power", 0,
-        Subsignal("audio_on", Pins("G13"), IOStandard("LVCMOS33")),
-        Subsignal("fpga_sys_on", Pins("N13"), IOStandard("LVCMOS18")),
-        Subsignal("noisebias_on", Pins("A13"), IOStandard("LVCMOS33")),
-        Subsignal("allow_up5k_n", Pins("U7"), IOStandard("LVCMOS18")),
-        Subsignal("pwr_s0", Pins("U6"), IOStandard("LVCMOS18")),
-        Subsignal("pwr_s1", Pins("L13"), IOStandard("LVCMOS18")),
+        Subsignal("audio_on", _pins("G13"), IOStandard("LVCMOS33")),
+        Subsignal("fpga_sys_on", _pins("N13"), IOStandard("LVCMOS18")),
+        Subsignal("noisebias_on", _pins("A13"), IOStandard("LVCMOS33")),
+        Subsignal("allow_up5k_n", _pins("U7"), IOStandard("LVCMOS18")),
+        Subsignal("pwr_s0", _pins("U6"), IOStandard("LVCMOS18")),
+        Subsignal("pwr_s1", _pins("L13"), IOStandard("LVCMOS18")),
         # Noise generator
-        Subsignal("noise_on", Pins("P14", "R13"), IOStandard("LVCMOS18")),
-    #    ("noise0", 0, Pins("B13"), IOStandard("LVCMOS33")), # these are analog
-    #    ("noise1", 0, Pins("B14"), IOStandard("LVCMOS33")),
+        Subsignal("noise_on", _pins("P14", "R13"), IOStandard("LVCMOS18")),
+    #    ("noise0", 0, _pins("B13"), IOStandard("LVCMOS33")), # these are analog
+    #    ("noise1", 0, _pins("B14"), IOStandard("LVCMOS33")),
      ),
 
     # Audio interface
-    ("au_clk1", 0, Pins("D14"), IOStandard("LVCMOS33")),
-    ("au_clk2", 0, Pins("F14"), IOStandard("LVCMOS33")),
-    ("au_mclk", 0, Pins("D18"), IOStandard("LVCMOS33")),
-    ("au_sdi1", 0, Pins("D12"), IOStandard("LVCMOS33")),
-    ("au_sdi2", 0, Pins("A15"), IOStandard("LVCMOS33")),
-    ("au_sdo1", 0, Pins("C13"), IOStandard("LVCMOS33")),
-    ("au_sync1", 0, Pins("B15"), IOStandard("LVCMOS33")),
-    ("au_sync2", 0, Pins("B17"), IOStandard("LVCMOS33")),
-#    ("ana_vn", 0, Pins("K9"), IOStandard("LVCMOS33")), # analog
-#    ("ana_vp", 0, Pins("J10"), IOStandard("LVCMOS33")),
+    ("au_clk1", 0, _pins("D14"), IOStandard("LVCMOS33")),
+    ("au_clk2", 0, _pins("F14"), IOStandard("LVCMOS33")),
+    ("au_mclk", 0, _pins("D18"), IOStandard("LVCMOS33")),
+    ("au_sdi1", 0, _pins("D12"), IOStandard("LVCMOS33")),
+    ("au_sdi2", 0, _pins("A15"), IOStandard("LVCMOS33")),
+    ("au_sdo1", 0, _pins("C13"), IOStandard("LVCMOS33")),
+    ("au_sync1", 0, _pins("B15"), IOStandard("LVCMOS33")),
+    ("au_sync2", 0, _pins("B17"), IOStandard("LVCMOS33")),
+#    ("ana_vn", 0, _pins("K9"), IOStandard("LVCMOS33")), # analog
+#    ("ana_vp", 0, _pins("J10"), IOStandard("LVCMOS33")),
 
     # I2C1 bus -- to RTC and audio CODEC
     ("i2c", 0,
-        Subsignal("scl", Pins("C14"), IOStandard("LVCMOS33")),
-        Subsignal("sda", Pins("A14"), IOStandard("LVCMOS33")),
+        Subsignal("scl", _pins("C14"), IOStandard("LVCMOS33")),
+        Subsignal("sda", _pins("A14"), IOStandard("LVCMOS33")),
      ),
     # RTC interrupt
-    ("rtc_irq", 0, Pins("N5"), IOStandard("LVCMOS18")),
+    ("rtc_irq", 0, _pins("N5"), IOStandard("LVCMOS18")),
 
     # COM interface to UP5K
     ("com", 0,
-        Subsignal("csn", Pins("T15"), IOStandard("LVCMOS18")),
-        Subsignal("miso", Pins("P16"), IOStandard("LVCMOS18")),
-        Subsignal("mosi", Pins("N18"), IOStandard("LVCMOS18")),
-        Subsignal("sclk", Pins("R16"), IOStandard("LVCMOS18")),
+        Subsignal("csn", _pins("T15"), IOStandard("LVCMOS18")),
+        Subsignal("miso", _pins("P16"), IOStandard("LVCMOS18")),
+        Subsignal("mosi", _pins("N18"), IOStandard("LVCMOS18")),
+        Subsignal("sclk", _pins("R16"), IOStandard("LVCMOS18")),
      ),
-    ("com_irq", 0, Pins("M16"), IOStandard("LVCMOS18")),
+    ("com_irq", 0, _pins("M16"), IOStandard("LVCMOS18")),
 
     # Top-side internal FPC header
-    ("gpio", 0, Pins("A16", "B16", "D16"), IOStandard("LVCMOS33"), Misc("SLEW=SLOW")), # B18 and D15 are used by the serial bridge
+    ("gpio", 0, _pins("A16", "B16", "D16"), IOStandard("LVCMOS33"), Misc("SLEW=SLOW")), # B18 and D15 are used by the serial bridge
 
     # Keyboard scan matrix
     ("kbd", 0,
         # "key" 0-8 are rows, 9-18 are columns
-        Subsignal("row", Pins("F15", "E17", "G17", "E14", "E15", "H15", "G15", "H14",
+        Subsignal("row", _pins("F15", "E17", "G17", "E14", "E15", "H15", "G15", "H14",
                               "H16"), IOStandard("LVCMOS33"), Misc("PULLDOWN True")),  # column scan with 1's, so PD to default 0
-        Subsignal("col", Pins("H17", "E18", "F18", "G18", "E13", "H18", "F13",
+        Subsignal("col", _pins("H17", "E18", "F18", "G18", "E13", "H18", "F13",
                               "H13", "J13", "K13"), IOStandard("LVCMOS33")),
     ),
 
     # LCD interface
     ("lcd", 0,
-        Subsignal("sclk", Pins("A17"), IOStandard("LVCMOS33"), Misc("SLEW=SLOW")),
-        Subsignal("scs", Pins("C18"), IOStandard("LVCMOS33"), Misc("SLEW=SLOW")),
-        Subsignal("si", Pins("D17"), IOStandard("LVCMOS33"), Misc("SLEW=SLOW")),
+        Subsignal("sclk", _pins("A17"), IOStandard("LVCMOS33"), Misc("SLEW=SLOW")),
+        Subsignal("scs", _pins("C18"), IOStandard("LVCMOS33"), Misc("SLEW=SLOW")),
+        Subsignal("si", _pins("D17"), IOStandard("LVCMOS33"), Misc("SLEW=SLOW")),
      ),
 
     # SD card (TF) interface
     ("sdcard", 0,
-     Subsignal("data", Pins("J15 J14 K16 K14"), Misc("PULLUP True")),
-     Subsignal("cmd", Pins("J16"), Misc("PULLUP True")),
-     Subsignal("clk", Pins("G16")),
+     Subsignal("data", _pins("J15 J14 K16 K14"), Misc("PULLUP True")),
+     Subsignal("cmd", _pins("J16"), Misc("PULLUP True")),
+     Subsignal("clk", _pins("G16")),
      IOStandard("LVCMOS33"), Misc("SLEW=SLOW")
      ),
 
     # SPI Flash
     ("spiflash_4x", 0,  # clock needs to be accessed through STARTUPE2
-     Subsignal("cs_n", Pins("M13")),
-     Subsignal("dq", Pins("K17", "K18", "L14", "M15")),
+     Subsignal("cs_n", _pins("M13")),
+     Subsignal("dq", _pins("K17", "K18", "L14", "M15")),
      IOStandard("LVCMOS18")
      ),
     ("spiflash_1x", 0,  # clock needs to be accessed through STARTUPE2
-     Subsignal("cs_n", Pins("M13")),
-     Subsignal("mosi", Pins("K17")),
-     Subsignal("miso", Pins("K18")),
-     Subsignal("wp", Pins("L14")), # provisional
-     Subsignal("hold", Pins("M15")), # provisional
+     Subsignal("cs_n", _pins("M13")),
+     Subsignal("mosi", _pins("K17")),
+     Subsignal("miso", _pins("K18")),
+     Subsignal("wp", _pins("L14")), # provisional
+     Subsignal("hold", _pins("M15")), # provisional
      IOStandard("LVCMOS18")
      ),
     ("spiflash_8x", 0,  # clock needs to be accessed through STARTUPE2
-     Subsignal("cs_n", Pins("M13")),
-     Subsignal("dq", Pins("K17", "K18", "L14", "M15", "L17", "L18", "M14", "N14")),
-     Subsignal("dqs", Pins("R14")),
-     Subsignal("ecsn", Pins("L16")),
+     Subsignal("cs_n", _pins("M13")),
+     Subsignal("dq", _pins("K17", "K18", "L14", "M15", "L17", "L18", "M14", "N14")),
+     Subsignal("dqs", _pins("R14")),
+     Subsignal("ecsn", _pins("L16")),
      IOStandard("LVCMOS18")
      ),
 
     # SRAM
     ("sram", 0,
-        Subsignal("adr", Pins(
-            "V12 M5 P5 N4  V14 M3 R17 U15",
-            "M4  L6 K3 R18 U16 K1 R5  T2",
-            "U1  N1 L5 K2  M18 T6"),
-            IOStandard("LVCMOS18")),
-        Subsignal("ce_n", Pins("V5"), IOStandard("LVCMOS18"), Misc("PULLUP True")),
-        Subsignal("oe_n", Pins("U12"), IOStandard("LVCMOS18"), Misc("PULLUP True")),
-        Subsignal("we_n", Pins("K4"), IOStandard("LVCMOS18"), Misc("PULLUP True")),
-        Subsignal("zz_n", Pins("V17"), IOStandard("LVCMOS18"), Misc("PULLUP True")),
-        Subsignal("d", Pins(
-            "M2  R4  P2  L4  L1  M1  R1  P1 "
-            "U3  V2  V4  U2  N2  T1  K6  J6 "
-            "V16 V15 U17 U18 P17 T18 P18 M17 "
-            "N3  T4  V13 P15 T14 R15 T3  R7 "), IOStandard("LVCMOS18")),
-        Subsignal("dm_n", Pins("V3 R2 T5 T13"), IOStandard("LVCMOS18")),
+        Subsignal("adr", _pins(*SRAM_ADR), IOStandard("LVCMOS18")),
+        Subsignal("ce_n", _pins("V5"), IOStandard("LVCMOS18"), Misc("PULLUP True")),
+        Subsignal("oe_n", _pins("U12"), IOStandard("LVCMOS18"), Misc("PULLUP True")),
+        Subsignal("we_n", _pins("K4"), IOStandard("LVCMOS18"), Misc("PULLUP True")),
+        Subsignal("zz_n", _pins("V17"), IOStandard("LVCMOS18"), Misc("PULLUP True")),
+        Subsignal("d", _pins(*SRAM_D), IOStandard("LVCMOS18")),
+        Subsignal("dm_n", _pins("V3 R2 T5 T13"), IOStandard("LVCMOS18")),
     ),
 ]
 
 class Platform(XilinxPlatform):
-    def __init__(self, toolchain="vivado", programmer="vivado", part="50"):
+    def __init__(self, toolchain="vivado", programmer="vivado", part="50", incremental=False):
         part = "xc7s" + part + "-csga324-1il"
         XilinxPlatform.__init__(self, part, _io,
                                 toolchain=toolchain)
@@ -175,15 +191,31 @@ class Platform(XilinxPlatform):
         self.add_platform_command(
             "set_property BITSTREAM.CONFIG.CONFIGRATE 66 [current_design]")
         self.add_platform_command(
-            "set_property BITSTREAM.CONFIG.SPI_BUSWIDTH 1 [current_design]")
+            "set_property BITSTREAM.CONFIG.SPI_BUSWIDTH 4 [current_design]")
+        # sample configuration data on the falling edge to gain half a CCLK of setup margin
+        self.add_platform_command(
+            "set_property BITSTREAM.CONFIG.SPI_FALL_EDGE YES [current_design]")
         self.toolchain.bitstream_commands = [
             "set_property CONFIG_VOLTAGE 1.8 [current_design]",
             "set_property CFGBVS GND [current_design]",
             "set_property BITSTREAM.CONFIG.CONFIGRATE 66 [current_design]",
-            "set_property BITSTREAM.CONFIG.SPI_BUSWIDTH 1 [current_design]",
+            "set_property BITSTREAM.CONFIG.SPI_BUSWIDTH 4 [current_design]",
+            "set_property BITSTREAM.CONFIG.SPI_FALL_EDGE YES [current_design]",
         ]
-        self.toolchain.additional_commands = \
-            ["write_cfgmem -verbose -force -format bin -interface spix1 -size 64 "
+        self.toolchain.additional_commands = []
+        if incremental:
+            # incremental compile: reuse the previous routed checkpoint as a placement/routing guide; the caller only
+            # asks for this when that checkpoint exists, since LiteX's incremental_implementation reads it unconditionally
+            # (Vivado doesn't support partial reconfiguration on Spartan-7, so a CPU-only partial rebuild isn't an option)
+            # only meant for reproduceable-seed builds: it pulls placement towards the last build instead of re-randomizing it
+            if hasattr(self.toolchain, "incremental_implementation"):
+                self.toolchain.incremental_implementation = True
+            else:
+                # the flow only rewrites {build_name}_route.dcp after route_design, so at this point it's still the last build's
+                self.toolchain.pre_placement_commands.append(
+                    "if {{[file exists {build_name}_route.dcp]}} {{read_checkpoint -incremental {build_name}_route.dcp}}")
+        self.toolchain.additional_commands += \
+            ["write_cfgmem -verbose -force -format bin -interface spix4 -size 16 "
              "-loadbit \"up 0x0 {build_name}.bit\" -file {build_name}.bin"]
         self.programmer = programmer
 
@@ -199,8 +231,15 @@ class Platform(XilinxPlatform):
 
 slow_clock = False
 
+if slow_clock:
+    SYS_CLK_FREQ = 12000000
+else:
+    SYS_CLK_FREQ = 100000000
+SYS_CLK_PERIOD_NS = 1e9 / SYS_CLK_FREQ
+TICK_DIV = SYS_CLK_FREQ // 1000  # sysclks per millisecond tick
+
 class CRG(Module, AutoCSR):
-    def __init__(self, platform):
+    def __init__(self, platform, drp_legacy=False):
         refclk_freq = 12e6
 
         clk12 = platform.request("clk12")
@@ -208,6 +247,7 @@ class CRG(Module, AutoCSR):
         self.clock_domains.cd_sys = ClockDomain()
         self.clock_domains.cd_spi = ClockDomain()
         self.clock_domains.cd_lpclk = ClockDomain()
+        self.spi_active = Signal(reset=1) # clock enable for cd_spi, only used when clocked from the MMCM
 
         clk32khz = platform.request("lpclk")
         self.specials += [
@@ -222,12 +262,32 @@ class CRG(Module, AutoCSR):
 
         else:
             # DRP
-            self._mmcm_read = CSR()
-            self._mmcm_write = CSR()
-            self._mmcm_drdy = CSRStatus()
-            self._mmcm_adr = CSRStorage(7)
-            self._mmcm_dat_w = CSRStorage(16)
-            self._mmcm_dat_r = CSRStatus(16)
+            # a complete DRP access is a single write to mmcm_cmd (one UART bridge burst); the sequencer below
+            # drives the MMCM and latches the result into mmcm_resp
+            self._mmcm_cmd = CSRStorage(fields=[
+                CSRField("adr", size=7, description="DRP register address"),
+                CSRField("write", description="`1` for a DRP write of `dat`, `0` for a DRP read"),
+                CSRField("dat", size=16, description="Data to write to the DRP register"),
+                CSRField("go", description="Write `1` to start the DRP access. Ignored while `mmcm_resp.busy` is set, so poll `busy` before issuing the next command", pulse=True),
+            ])
+            self._mmcm_resp = CSRStatus(fields=[
+                CSRField("dat", size=16, description="Data read from the DRP register by the last read access"),
+                CSRField("busy", description="Set while a DRP access is in progress"),
+                CSRField("timeout", description="Set if the last DRP access got no `DRDY` within 64 cycles and was abandoned"),
+            ])
+            if drp_legacy:
+                self._mmcm_read = CSR()
+                self._mmcm_write = CSR()
+                self._mmcm_drdy = CSRStatus()
+                self._mmcm_adr = CSRStorage(7)
+                self._mmcm_dat_w = CSRStorage(16)
+                self._mmcm_dat_r = CSRStatus(16)
+
+            drp_den = Signal()
+            drp_dwe = Signal()
+            drp_daddr = Signal(7)
+            drp_di = Signal(16)
+            drp_do = Signal(16)
 
             pll_locked = Signal()
             pll_fb = Signal()
@@ -263,12 +323,12 @@ class CRG(Module, AutoCSR):
 
                          # DRP
                          i_DCLK=ClockSignal(),
-                         i_DWE=self._mmcm_write.re,
-                         i_DEN=self._mmcm_read.re | self._mmcm_write.re,
+                         i_DWE=drp_dwe,
+                         i_DEN=drp_den,
                          o_DRDY=mmcm_drdy,
-                         i_DADDR=self._mmcm_adr.storage,
-                         i_DI=self._mmcm_dat_w.storage,
-                         o_DO=self._mmcm_dat_r.status,
+                         i_DADDR=drp_daddr,
+                         i_DI=drp_di,
+                         o_DO=drp_do,
 
                          # Warm reset
                          i_RST=self.warm_reset,
@@ -279,18 +339,70 @@ class CRG(Module, AutoCSR):
 
                 # global distribution buffers
                 Instance("BUFG", i_I=pll_sys, o_O=self.cd_sys.clk),
-                Instance("BUFG", i_I=pll_spiclk, o_O=self.cd_spi.clk),
+                Instance("BUFGCE", i_I=pll_spiclk, i_CE=self.spi_active, o_O=self.cd_spi.clk),
 
                 AsyncResetSynchronizer(self.cd_sys, rst | ~pll_locked),
                 AsyncResetSynchronizer(self.cd_spi, rst | ~pll_locked),
             ]
-            self.sync += [
-                If(self._mmcm_read.re | self._mmcm_write.re,
-                   self._mmcm_drdy.status.eq(0)
-                   ).Elif(mmcm_drdy,
-                          self._mmcm_drdy.status.eq(1)
-                          )
-            ]
+
+            # DRDY normally follows DEN within a few DCLK cycles; give up on it after drp_timeout cycles so busy can't stick
+            # a go that arrives while busy is dropped, so DEN is never reasserted before the previous DRDY
+            drp_timeout = 64
+            drp_count = Signal(max=drp_timeout+1)
+            drp_fsm = FSM(reset_state="IDLE")
+            self.submodules += drp_fsm
+            drp_fsm.act("IDLE",
+                If(self._mmcm_cmd.fields.go,
+                   NextState("STROBE"),
+                )
+            )
+            drp_fsm.act("STROBE",
+                self._mmcm_resp.fields.busy.eq(1),
+                drp_den.eq(1),
+                drp_dwe.eq(self._mmcm_cmd.fields.write),
+                NextValue(drp_count, 0),
+                NextValue(self._mmcm_resp.fields.timeout, 0),
+                NextState("WAIT"),
+            )
+            drp_fsm.act("WAIT",
+                self._mmcm_resp.fields.busy.eq(1),
+                NextValue(drp_count, drp_count + 1),
+                If(mmcm_drdy,
+                   If(~self._mmcm_cmd.fields.write,
+                      NextValue(self._mmcm_resp.fields.dat, drp_do),
+                   ),
+                   NextState("IDLE"),
+                ).Elif(drp_count == drp_timeout,
+                   NextValue(self._mmcm_resp.fields.timeout, 1),
+                   NextState("IDLE"),
+                )
+            )
+
+            if drp_legacy:
+                self.comb += [
+                    If(drp_fsm.ongoing("IDLE"),
+                       drp_dwe.eq(self._mmcm_write.re),
+                       drp_den.eq(self._mmcm_read.re | self._mmcm_write.re),
+                       drp_daddr.eq(self._mmcm_adr.storage),
+                       drp_di.eq(self._mmcm_dat_w.storage),
+                    ).Else(
+                       drp_daddr.eq(self._mmcm_cmd.fields.adr),
+                       drp_di.eq(self._mmcm_cmd.fields.dat),
+                    ),
+                    self._mmcm_dat_r.status.eq(drp_do),
+                ]
+                self.sync += [
+                    If(self._mmcm_read.re | self._mmcm_write.re,
+                       self._mmcm_drdy.status.eq(0)
+                       ).Elif(mmcm_drdy,
+                              self._mmcm_drdy.status.eq(1)
+                              )
+                ]
+            else:
+                self.comb += [
+                    drp_daddr.eq(self._mmcm_cmd.fields.adr),
+                    drp_di.eq(self._mmcm_cmd.fields.dat),
+                ]
 
 class WarmBoot(Module, AutoCSR):
     def __init__(self, parent, reset_vector=0):
@@ -343,12 +455,24 @@ class BtPower(Module, AutoCSR, AutoDoc):
 
 class BtGpio(Module, AutoDoc, AutoCSR):
     def __init__(self, pads):
-        self.intro = ModuleDoc("""BtGpio - GPIO interface for betrusted""")
+        self.intro = ModuleDoc("""BtGpio - GPIO interface for betrusted
+
+        All pads share a single `gpio` interrupt event. This replaces the per-pin `gpioint0`..`gpioint2`
+        events of earlier builds, so software has to be updated: on a `gpio` interrupt, read `raw_pending`
+        to find the pin(s) that triggered and write those bits to `raw_clear`. The `gpio` event is a level
+        that follows `raw_pending`, so it deasserts once every bit has been cleared; writing the event's
+        pending register has no effect. A `raw_pending` bit is set by the edge selected in `intpol` (rising
+        by default), not by the pin level, so clearing it sticks until the next edge. Pins are masked
+        individually with `intena`; a masked pin never sets its `raw_pending` bit. Enabling a pin in
+        `intena`, or changing its `intpol`, while it is at its active level counts as an edge and sets its
+        `raw_pending` bit.
+        """)
 
         gpio_in = Signal(pads.nbits)
         gpio_out = Signal(pads.nbits)
         gpio_oe = Signal(pads.nbits)
 
+        # one TSTriple per pad: a TSTriple has a single OE, and each pad has its own `drive` bit
         for g in range(0, pads.nbits):
             gpio_ts = TSTriple(1)
             self.specials += gpio_ts.get_tristate(pads[g])
@@ -361,8 +485,8 @@ class BtGpio(Module, AutoDoc, AutoCSR):
         self.output = CSRStorage(pads.nbits, name="output", description="Values to appear on GPIO when respective `drive` bit is asserted")
         self.input = CSRStatus(pads.nbits, name="input", description="Value measured on the respective GPIO pin")
         self.drive = CSRStorage(pads.nbits, name="drive", description="When a bit is set to `1`, the respective pad drives its value out")
-        self.intena = CSRStatus(pads.nbits, name="intena", description="Enable interrupts when a respective bit is set")
-        self.intpol = CSRStatus(pads.nbits, name="intpol", description="When a bit is `1`, falling-edges cause interrupts. Otherwise, rising edges cause interrupts.")
+        self.intena = CSRStorage(pads.nbits, name="intena", description="Enable interrupts when a respective bit is set")
+        self.intpol = CSRStorage(pads.nbits, name="intpol", description="When a bit is `1`, falling-edges cause interrupts. Otherwise, rising edges cause interrupts.")
 
         self.specials += MultiReg(gpio_in, self.input.status)
         self.comb += [
@@ -370,17 +494,33 @@ class BtGpio(Module, AutoDoc, AutoCSR):
             gpio_oe.eq(self.drive.storage),
         ]
 
-        self.submodules.ev = EventManager()
-
-        for i in range(0, pads.nbits):
-            setattr(self.ev, "gpioint" + str(i), EventSourcePulse() ) # pulse => rising edge
+        # a single interrupt for all pads; raw_pending says which pad(s) caused it
+        self.raw_pending = CSRStatus(pads.nbits, name="raw_pending", description="Set when the respective GPIO has triggered an interrupt")
+        self.raw_clear = CSRStorage(pads.nbits, name="raw_clear", description="Write `1` to a bit to clear the respective `raw_pending` bit")
 
+        self.submodules.ev = EventManager()
+        self.ev.gpio = EventSourceLevel() # asserted while any raw_pending bit is set
         self.ev.finalize()
 
-        for i in range(0, pads.nbits):
-            # pull from input.status because it's after the MultiReg synchronizer
-            self.comb += getattr(self.ev, "gpioint" + str(i)).trigger.eq(self.input.status[i] ^ self.intpol.status[i])
-            # note that if you change the polarity on the interrupt it could trigger an interrupt
+        # pull from input.status because it's after the MultiReg synchronizer
+        # note that if you change the polarity on the interrupt, or enable it while the pin is at its active level,
+        # it could trigger an interrupt
+        gpio_trig = Signal(pads.nbits)
+        gpio_trig_d = Signal(pads.nbits)
+        gpio_edge = Signal(pads.nbits)
+        self.comb += [
+            gpio_trig.eq((self.input.status ^ self.intpol.storage) & self.intena.storage),
+            gpio_edge.eq(gpio_trig & ~gpio_trig_d),  # only the edge into the active level sets raw_pending
+        ]
+        self.sync += [
+            gpio_trig_d.eq(gpio_trig),
+            If(self.raw_clear.re,
+               self.raw_pending.status.eq((self.raw_pending.status & ~self.raw_clear.storage) | gpio_edge)
+            ).Else(
+               self.raw_pending.status.eq(self.raw_pending.status | gpio_edge)
+            )
+        ]
+        self.comb += self.ev.gpio.trigger.eq(self.raw_pending.status != 0)
 
 class BtSeed(Module, AutoDoc, AutoCSR):
     def __init__(self, reproduceable=False):
@@ -388,10 +528,10 @@ class BtSeed(Module, AutoDoc, AutoCSR):
         Use a random number or your own number if you are paranoid about hardware implants that target
         fixed locations within the FPGA.""")
 
-        rng = SystemRandom()
         if reproduceable:
             self.seed = CSRStatus(64, name="seed", description="Seed used for the build", reset="4") # chosen by fair dice roll. guaranteed to be random.
         else:
+            rng = SystemRandom()
             self.seed = CSRStatus(64, name="seed", description="Seed used for the build", reset=rng.getrandbits(64))
 
 
@@ -413,11 +553,12 @@ class BaseSoC(SoCCore):
         "csr": 0xF0000000,
     }
 
-    def __init__(self, platform, spiflash="spiflash_1x", **kwargs):
-        if slow_clock:
-            clk_freq = int(12e6)
-        else:
-            clk_freq = int(100e6)
+    def __init__(self, platform, spiflash="spiflash_4x", reproduceable=False, qe_init=False, drp_legacy=False, **kwargs):
+        clk_freq = SYS_CLK_FREQ
+
+        # request every pad group used below exactly once, up front
+        pads = {name: platform.request(name) for name in ("power", "com", "i2c", "lcd", "gpio", "kbd",
+                                                          "com_irq", "rtc_irq", spiflash, "sram", "debug")}
 
         # CPU cluster
         ## For dev work, we're booting from SPI directly. However, for enhanced security
@@ -437,7 +578,6 @@ class BaseSoC(SoCCore):
         self.add_memory_region("rom", 0, 0) # Required to keep litex happy
         kwargs['cpu_reset_address']=self.mem_map["spiflash"]+boot_offset
         self.submodules.reboot = WarmBoot(self, reset_vector=kwargs['cpu_reset_address'])
-        self.add_csr("reboot")
         warm_reset = Signal()
         self.comb += warm_reset.eq(self.reboot.do_reset)
         self.cpu.cpu_params.update(
@@ -445,14 +585,13 @@ class BaseSoC(SoCCore):
         )
         # Debug cluster
         from litex.soc.cores.uart import UARTWishboneBridge
-        self.submodules.uart_bridge = UARTWishboneBridge(platform.request("debug"), clk_freq, baudrate=115200)
+        self.submodules.uart_bridge = UARTWishboneBridge(pads["debug"], clk_freq, baudrate=115200)
         self.add_wb_master(self.uart_bridge.wishbone)
         self.register_mem("vexriscv_debug", 0xe00f0000, self.cpu.debug_bus, 0x100)
 
         # clockgen cluster
-        self.submodules.crg = CRG(platform)
-        self.add_csr("crg")
-        self.platform.add_period_constraint(self.crg.cd_sys.clk, 1e9/clk_freq)
+        self.submodules.crg = CRG(platform, drp_legacy=drp_legacy)
+        self.platform.add_period_constraint(self.crg.cd_sys.clk, SYS_CLK_PERIOD_NS)
         self.comb += self.crg.warm_reset.eq(warm_reset)
         self.platform.add_platform_command(
             "create_clock -name clk12 -period 83.3333 [get_nets clk12]")
@@ -467,16 +606,14 @@ class BaseSoC(SoCCore):
         )
 
         self.submodules.info = info.Info(platform, self.__class__.__name__)
-        self.add_csr("info")
         self.platform.add_platform_command('create_generated_clock -name dna_cnt -source [get_pins {{info_dna_cnt_reg[0]/Q}}] -divide_by 2 [get_pins {{DNA_PORT/CLK}}]')
+        # DOUT is sampled a full sysclk after the DNA_PORT clock edge that launches it, and only once after configuration
+        self.platform.add_platform_command('set_false_path -through [get_pins {{DNA_PORT/DOUT}}]')
 
         # external SRAM
         # Note that page_rd_timing=2 works, but is a slight overclock on RAM. Cache fill time goes from 436ns to 368ns for 8 words.
-        self.submodules.sram_ext = sram_32.Sram32(platform.request("sram"), rd_timing=7, wr_timing=6, page_rd_timing=3)  # this works with 2:nbits page length with Rust firmware...
+        self.submodules.sram_ext = sram_32.Sram32(pads["sram"], rd_timing=7, wr_timing=6, page_rd_timing=3)  # this works with 2:nbits page length with Rust firmware...
         #self.submodules.sram_ext = sram_32.Sram32(platform.request("sram"), rd_timing=7, wr_timing=6, page_rd_timing=5)  # this worked with 3:nbits page length in C firmware
-        self.add_csr("sram_ext")
-        self.register_mem("sram_ext", self.mem_map["sram_ext"],
-                  self.sram_ext.bus, size=0x1000000)
         # constraint so a total of one extra clock period is consumed in routing delays (split 5/5 evenly on in and out)
         self.platform.add_platform_command("set_input_delay -clock [get_clocks sys_clk] -min -add_delay 5.0 [get_ports {{sram_d[*]}}]")
         self.platform.add_platform_command("set_input_delay -clock [get_clocks sys_clk] -max -add_delay 5.0 [get_ports {{sram_d[*]}}]")
@@ -495,13 +632,11 @@ class BaseSoC(SoCCore):
         self.platform.add_platform_command("set_multicycle_path 1 -hold -through [get_pins sram_ext_sync_oe_n_reg/Q]")
 
         # LCD interface
-        self.submodules.memlcd = memlcd.Memlcd(platform.request("lcd"))
-        self.add_csr("memlcd")
-        self.register_mem("memlcd", self.mem_map["memlcd"], self.memlcd.bus, size=self.memlcd.fb_depth*4)
+        self.submodules.memlcd = memlcd.Memlcd(pads["lcd"])
 
         # COM SPI interface
-        self.submodules.com = spi.SpiMaster(platform.request("com"))
-        self.add_csr("com")
+        self.submodules.com = spi.SpiMaster(pads["com"])
+        self.comb += self.crg.spi_active.eq(self.com.active)  # stop the spi clock tree while the COM link is idle
         # 20.83ns = 1/2 of 24MHz clock, we are doing falling-to-rising timing
         # up5k tsu = -0.5ns, th = 5.55ns, tpdmax = 10ns
         # in reality, we are measuring a Tpd from the UP5K of 17ns. Routed input delay is ~3.9ns, which means
@@ -512,51 +647,71 @@ class BaseSoC(SoCCore):
         self.platform.add_platform_command("set_output_delay -clock [get_clocks spi_clk] -min -add_delay 6.0 [get_ports {{com_mosi com_csn}}]")
         self.platform.add_platform_command("set_output_delay -clock [get_clocks spi_clk] -max -add_delay 16.0 [get_ports {{com_mosi com_csn}}]")  # could be as large as 21ns but why not
         # cross domain clocking is handled with explicit software barrires, or with multiregs
-        self.platform.add_false_path_constraints(self.crg.cd_sys.clk, self.crg.cd_spi.clk)
-        self.platform.add_false_path_constraints(self.crg.cd_spi.clk, self.crg.cd_sys.clk)
+        # bound the crossings instead of false-pathing them, so the router still keeps these nets short
+        self.platform.add_platform_command("set_max_delay -datapath_only -from [get_clocks sys_clk] -to [get_clocks spi_clk] 20.0")
+        self.platform.add_platform_command("set_max_delay -datapath_only -from [get_clocks spi_clk] -to [get_clocks sys_clk] 10.0")
 
         # add I2C interface
-        self.submodules.i2c = i2c.RTLI2C(platform, platform.request("i2c", 0))
-        self.add_csr("i2c")
-        self.add_interrupt("i2c")
+        self.submodules.i2c = i2c.RTLI2C(platform, pads["i2c"])
 
         # event generation for I2C and COM
-        self.submodules.btevents = BtEvents(platform.request("com_irq", 0), platform.request("rtc_irq", 0))
-        self.add_csr("btevents")
-        self.add_interrupt("btevents")
+        self.submodules.btevents = BtEvents(pads["com_irq"], pads["rtc_irq"])
 
         # add messible for debug
         self.submodules.messible = messible.Messible()
-        self.add_csr("messible")
 
         # Tick timer
-        self.submodules.ticktimer = ticktimer.TickTimer(clk_freq / 1000)
-        self.add_csr("ticktimer")
+        self.submodules.ticktimer = ticktimer.TickTimer(TICK_DIV)
 
         # Power control pins
-        self.submodules.power = BtPower(platform.request("power"))
-        self.add_csr("power")
+        self.submodules.power = BtPower(pads["power"])
 
         # SPI flash controller
-        spi_pads = platform.request("spiflash_1x")
-        self.submodules.spinor = spinor.SpiNor(platform, spi_pads, size=SPI_FLASH_SIZE)
-        self.register_mem("spiflash", self.mem_map["spiflash"],
-            self.spinor.bus, size=SPI_FLASH_SIZE)
-        self.add_csr("spinor")
+        spi_pads = pads[spiflash]
+        if spiflash == "spiflash_4x":
+            spi_width = 4
+        else:
+            spi_width = 1
+        # qe_init runs a Winbond-only QE bit sequence at reset, so it stays off unless the board has a W25Q part
+        self.submodules.spinor = spinor.SpiNor(platform, spi_pads, size=SPI_FLASH_SIZE, width=spi_width, qe_init=qe_init)
 
         # Keyboard module
-        self.submodules.keyboard = ClockDomainsRenamer(cd_remapping={"kbd":"lpclk"})(keyboard.KeyScan(platform.request("kbd")))
-        self.add_csr("keyboard")
-        self.add_interrupt("keyboard")
+        self.submodules.keyboard = ClockDomainsRenamer(cd_remapping={"kbd":"lpclk"})(keyboard.KeyScan(pads["kbd"]))
+        # keyboard CSRs cross between sys and lpclk through multiregs; bound those crossings as well
+        self.platform.add_platform_command("set_max_delay -datapath_only -from [get_clocks sys_clk] -to [get_clocks lpclk] 30517.0")
+        self.platform.add_platform_command("set_max_delay -datapath_only -from [get_clocks lpclk] -to [get_clocks sys_clk] 10.0")
 
         # GPIO module
-        self.submodules.gpio = BtGpio(platform.request("gpio"))
-        self.add_csr("gpio")
-        self.add_interrupt("gpio")
+        self.submodules.gpio = BtGpio(pads["gpio"])
 
         # Build seed
-        self.submodules.seed = BtSeed()
-        self.add_csr("seed")
+        self.submodules.seed = BtSeed(reproduceable=reproduceable)
+
+        # register CSRs, interrupts and bus regions in one pass: (submodule, has interrupt, (mem region, size) or None)
+        # order sets the CSR bank and IRQ numbers, so append new entries at the end
+        submods = [
+            ("reboot",    False, None),
+            ("crg",       False, None),
+            ("info",      False, None),
+            ("sram_ext",  False, ("sram_ext", 0x1000000)),
+            ("memlcd",    False, ("memlcd", self.memlcd.fb_depth*4)),
+            ("com",       False, None),
+            ("i2c",       True,  None),
+            ("btevents",  True,  None),
+            ("messible",  False, None),
+            ("ticktimer", False, None),
+            ("power",     False, None),
+            ("spinor",    False, ("spiflash", SPI_FLASH_SIZE)),
+            ("keyboard",  True,  None),
+            ("gpio",      True,  None),
+            ("seed",      False, None),
+        ]
+        for name, irq, mem in submods:
+            self.add_csr(name)
+            if irq:
+                self.add_interrupt(name)
+            if mem is not None:
+                self.register_mem(mem[0], self.mem_map[mem[0]], getattr(self, name).bus, size=mem[1])
 
         ## TODO: XADC, audio, wide-width/fast SPINOR, sdcard
 """
@@ -580,13 +735,50 @@ class BaseSoC(SoCCore):
 
 """
 
+# Hash of everything that goes into the gateware: this script, the gateware sources, the deps/ checkouts
+# (migen, litex, lxsocdoc, ...), the Vivado version unless `vivado` is False, and the build options.
+# Returns None if any of those can't be pinned down.
+def gateware_hash(*options, vivado=True):
+    h = hashlib.sha256()
+    try:
+        for dep in sorted(os.listdir(lxbuildenv.DEPS_DIR)):
+            path = os.path.join(lxbuildenv.DEPS_DIR, dep)
+            # HEAD plus any uncommitted changes on top of it
+            h.update(subprocess.check_output(["git", "-C", path, "rev-parse", "HEAD"]))
+            h.update(subprocess.check_output(["git", "-C", path, "diff", "HEAD"]))
+        if vivado:
+            vivado_bin = shutil.which("vivado")
+            if vivado_bin is None:
+                return None
+            h.update(subprocess.check_output([vivado_bin, "-version"]))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    sources = [os.path.realpath(__file__)]
+    for root, dirs, files in os.walk("gateware"):
+        dirs.sort()
+        for f in sorted(files):
+            if f.endswith(".py") or f.endswith(".v"):
+                sources.append(os.path.join(root, f))
+    for source in sources:
+        with open(source, "rb") as f:
+            h.update(f.read())
+    h.update(repr(options).encode())
+    return h.hexdigest()
+
+def manifest_matches(manifest, digest):
+    if digest is None or not os.path.isfile(manifest):
+        return False
+    with open(manifest, "r") as f:
+        return f.read().strip() == digest
 
 def main():
     global _io
 
-    if os.environ['PYTHONHASHSEED'] != "1":
-        print( "PYTHONHASHEED must be set to 1 for consistent validation results. Failing to set this results in non-deterministic compilation results")
-        exit()
+    if os.environ.get('PYTHONHASHSEED') != "1":
+        # PYTHONHASHSEED must be set to 1 for consistent validation results, and it only takes effect at
+        # interpreter startup, so re-exec ourselves with it set rather than making the user do it
+        env = dict(os.environ, PYTHONHASHSEED="1")
+        os.execve(sys.executable, [sys.executable] + sys.argv, env)
 
     parser = argparse.ArgumentParser(description="Build the Betrusted SoC")
     parser.add_argument(
@@ -595,8 +787,29 @@ def main():
     parser.add_argument(
         "-u", "--uart-swap", default=False, action="store_true", help="swap UART pins (GDB debug bridge <-> console)"
     )
+    parser.add_argument(
+        "-r", "--reproduceable", default=False, action="store_true", help="use a fixed place and route seed instead of a random one"
+    )
+    parser.add_argument(
+        "-q", "--qe-init", default=False, action="store_true",
+        help="set the SPI flash QE bit at reset with the Winbond W25Q sequence (don't use with Micron N25Q/MT25Q flash)"
+    )
+    parser.add_argument(
+        "--drp-legacy", default=False, action="store_true",
+        help="also provide the old mmcm_read/write/adr/dat_w/dat_r/drdy CSRs alongside mmcm_cmd/mmcm_resp"
+    )
+    parser.add_argument(
+        "-i", "--incremental", default=False, action="store_true",
+        help="skip Vivado if the sources are unchanged and guide place and route from the previous build (requires -r)"
+    )
+    parser.add_argument(
+        "-f", "--force", default=False, action="store_true", help="with -i, rebuild gateware and docs even if their sources are unchanged"
+    )
 
     args = parser.parse_args()
+    if args.incremental and not args.reproduceable:
+        # a random seed is there to vary placement from build to build; reusing the last build would defeat it
+        parser.error("--incremental requires --reproduceable")
     compile_gateware = True
     compile_software = False
 
@@ -604,42 +817,75 @@ def main():
         compile_gateware = False
         compile_software = False
 
+    manifest = "build/gateware/.manifest"
+    digest = gateware_hash(args.uart_swap, args.reproduceable, args.qe_init, args.drp_legacy) if args.incremental else None
+    if compile_gateware and not args.force and manifest_matches(manifest, digest) \
+            and os.path.isfile("build/gateware/top.bit"):
+        print("Gateware sources unchanged since the last build, skipping Vivado (use -f to force a rebuild)")
+        compile_gateware = False
+
     if args.uart_swap:
         _io += [
             ("serial", 0,  # wired to the RPi
-             Subsignal("tx", Pins("V6")),
-             Subsignal("rx", Pins("V7")),
+             Subsignal("tx", _pins("V6")),
+             Subsignal("rx", _pins("V7")),
              IOStandard("LVCMOS18"),
              ),
 
             ("debug", 0,   # wired to the internal flex
-             Subsignal("tx", Pins("B18")),  # debug0 breakout
-             Subsignal("rx", Pins("D15")),  # debug1
+             Subsignal("tx", _pins("B18")),  # debug0 breakout
+             Subsignal("rx", _pins("D15")),  # debug1
              IOStandard("LVCMOS33"),
              ),
         ]
     else:  # default to GDB bridge going to the Pi
         _io += [
             ("debug", 0,   # wired to the Rpi
-             Subsignal("tx", Pins("V6")),
-             Subsignal("rx", Pins("V7")),
+             Subsignal("tx", _pins("V6")),
+             Subsignal("rx", _pins("V7")),
              IOStandard("LVCMOS18"),
              ),
 
             ("serial", 0,  # wired to the internal flex
-             Subsignal("tx", Pins("B18")),  # debug0 breakout
-             Subsignal("rx", Pins("D15")),  # debug1
+             Subsignal("tx", _pins("B18")),  # debug0 breakout
+             Subsignal("rx", _pins("D15")),  # debug1
              IOStandard("LVCMOS33"),
              ),
         ]
 
-    platform = Platform()
-    soc = BaseSoC(platform)
+    # guide place and route from the last build only if there is a routed checkpoint to guide it from
+    platform = Platform(incremental=args.incremental and os.path.isfile("build/gateware/top_route.dcp"))
+    soc = BaseSoC(platform, reproduceable=args.reproduceable, qe_init=args.qe_init, drp_legacy=args.drp_legacy)
     builder = Builder(soc, output_dir="build", csr_csv="test/csr.csv", compile_software=compile_software, compile_gateware=compile_gateware)
+    if compile_gateware and os.path.isfile(manifest):
+        # top.bit is about to be replaced (or the build may fail half way): the old manifest no longer describes it
+        os.remove(manifest)
     vns = builder.build()
     soc.do_exit(vns)
-    lxsocdoc.generate_docs(soc, "build/documentation", note_pulses=True)
-    lxsocdoc.generate_svd(soc, "build/software", name="Betrusted SoC", description="Primary UI Core for Betrusted", filename="soc.svd", vendor="Betrusted-IO")
+    if compile_gateware and digest is not None:
+        with open(manifest, "w") as f:
+            f.write(digest + "\n")
+
+    # docs and SVD only depend on the sources (lxsocdoc included) and the resulting CSR map, not on Vivado,
+    # so with -i skip regenerating them if neither changed
+    doc_manifest = "build/documentation/.hash"
+    doc_digest = gateware_hash(args.uart_swap, args.reproduceable, args.qe_init, args.drp_legacy, vivado=False) if args.incremental else None
+    if doc_digest is not None:
+        h = hashlib.sha256(doc_digest.encode())
+        with open("test/csr.csv", "rb") as f:
+            h.update(f.read())
+        doc_digest = h.hexdigest()
+    if not args.force and manifest_matches(doc_manifest, doc_digest) and os.path.isfile("build/software/soc.svd"):
+        print("CSR map and sources unchanged, skipping documentation and SVD generation")
+    else:
+        if os.path.isfile(doc_manifest):
+            # same as the gateware manifest: drop it first so it only ever describes docs that were actually generated
+            os.remove(doc_manifest)
+        lxsocdoc.generate_docs(soc, "build/documentation", note_pulses=True)
+        lxsocdoc.generate_svd(soc, "build/software", name="Betrusted SoC", description="Primary UI Core for Betrusted", filename="soc.svd", vendor="Betrusted-IO")
+        if doc_digest is not None:
+            with open(doc_manifest, "w") as f:
+                f.write(doc_digest + "\n")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,39 @@
+from migen import *
+from litex.soc.interconnect.csr import *
+
+
+class DNA(Module, AutoCSR):
+    """Device DNA, read once after configuration.
+
+    Drop-in for litex.soc.cores.dna.DNA, except that the shift register and
+    the latched value are not reset: the 57-bit DNA is shifted out of DNA_PORT
+    only on the first run after configuration, and warm resets reuse the
+    latched value instead of shifting it out again. The readout only advances
+    while the sys reset is released, so it isn't clocked off the MMCM before it
+    has locked.
+    """
+    def __init__(self):
+        n = 57
+        self._id = CSRStatus(n)
+
+        dna = Signal(n, reset_less=True)
+        cnt = Signal(max=2*n + 1, reset_less=True)
+        valid = Signal(reset_less=True)
+        do = Signal()
+
+        self.comb += self._id.status.eq(dna)
+        self.sync += [
+            If(~valid & ~ResetSignal(),
+                If(cnt < 2*n,
+                    cnt.eq(cnt + 1),
+                    If(cnt[0],
+                        dna.eq(Cat(do, dna))
+                    )
+                ).Else(
+                    valid.eq(1)
+                )
+            )
+        ]
+        self.specials += Instance("DNA_PORT",
+            i_DIN=dna[n-1], o_DOUT=do,
+            i_CLK=cnt[0], i_READ=cnt < 2, i_SHIFT=1)
@@ -1,5 +1,4 @@
 from migen.genlib.cdc import MultiReg
-from migen.genlib.coding import Decoder
 
 from litex.soc.integration.doc import AutoDoc, ModuleDoc
 from litex.soc.interconnect.csr_eventmanager import *
@@ -45,9 +44,18 @@ class Debounce(Module):
 
 # A hardware key scanner that can run even when the CPU is powered down or stopped
 class KeyScan(Module, AutoCSR, AutoDoc):
-    def __init__(self, pads):
+    def __init__(self, pads, debounce=True):
+        self.intro = ModuleDoc("""KeyScan - hardware keyboard matrix scanner
+
+        Columns are driven by a rotating one-hot pattern that advances once per `kbd` clock, and all rows
+        are sampled on every clock, so a full matrix scan takes one `kbd` cycle per column. Samples are packed
+        into a single (rows x cols) vector; optionally each key is debounced by a 2-bit saturating up/down counter
+        which is updated once per completed scan (up when pressed, down when released). A key is reported pressed
+        when its counter reaches 3 and released when it returns to 0, so the hysteresis filters out isolated
+        bounces; from a settled state it takes at least three consecutive matching scans to change state.
+        """)
         rows_unsync = pads.row
-        cols = Signal(pads.col.nbits)
+        cols = Signal(pads.col.nbits, reset=1)
 
         for c in range(0, cols.nbits):
             cols_ts = TSTriple(1)
@@ -65,73 +73,82 @@ class KeyScan(Module, AutoCSR, AutoDoc):
         for r in range(0, rows.nbits):
             setattr(self, "row" + str(r) + "dat", CSRStatus(cols.nbits, name="row" + str(r) + "dat", description="""Column data for the given row"""))
 
-        settling=4  # 4 cycles to settle: 2 cycles for MultiReg stabilization + slop. Must be > 2, and a power of 2
-        colcount = Signal(max=(settling*cols.nbits+2))
+        nkeys = rows.nbits * cols.nbits
+
+        # rotate the one-hot column drive every cycle
+        self.sync.kbd += cols.eq(Cat(cols[-1], cols[:-1]))
+
+        # delay the column pattern by the 2 cycles of MultiReg latency on the rows, so it lines up with the sampled rows
+        col_d = Signal(cols.nbits)
+        col_r = Signal(cols.nbits)
+        self.sync.kbd += [
+            col_d.eq(cols),
+            col_r.eq(col_d),
+        ]
+
+        # packed row-major key vector: bit (r * cols + c) is the key at row r, column c
+        sample = Signal(nkeys)
+        self.comb += sample.eq(Cat(*[Replicate(rows[r], cols.nbits) & col_r for r in range(0, rows.nbits)]))
+
+        scan = Signal(nkeys)
+        frame = Signal(nkeys)
+        frame_valid = Signal()
+        self.sync.kbd += [
+            If(col_r[-1],  # last column of the scan is being sampled
+               scan.eq(0),
+               frame.eq(scan | sample),
+               frame_valid.eq(1),
+            ).Else(
+               scan.eq(scan | sample),
+               frame_valid.eq(0),
+            )
+        ]
+
+        keys = Signal(nkeys)
+        scan_done = Signal()
+        self.sync.kbd += scan_done.eq(frame_valid)
+        if debounce:
+            # 2-bit saturating up/down integrator per key, updated once per scan; sets at 3, clears at 0
+            count = Signal(2*nkeys)
+            for k in range(0, nkeys):
+                cnt = count[2*k:2*k+2]
+                self.sync.kbd += [
+                    If(frame_valid,
+                       If(frame[k],
+                          If(cnt != 3, cnt.eq(cnt + 1)),
+                          If(cnt == 2, keys[k].eq(1)),
+                       ).Else(
+                          If(cnt != 0, cnt.eq(cnt - 1)),
+                          If(cnt == 1, keys[k].eq(0)),
+                       )
+                    )
+                ]
+        else:
+            self.sync.kbd += If(frame_valid, keys.eq(frame))
 
         update_shadow = Signal()
         reset_scan = Signal()
-        scan_done = Signal()
-        col_r = Signal(cols.nbits)
         scan_done_sys = Signal()
         self.specials += MultiReg(scan_done, scan_done_sys)
+        pending_key = Signal()
+        scan_done_d = Signal()
+        self.sync.kbd += [
+            scan_done_d.eq(scan_done),
+            update_shadow.eq(scan_done & ~pending_key),  # only update the shadow if the pending bit has been cleared (e.g., CPU has acknowledged it has fetched the current key state)
+            reset_scan.eq(scan_done_d),
+        ]
         for r in range(0, rows.nbits):
-            row_scan = Signal(cols.nbits)
-            # below is in sysclock domain; row_scan is guaranteed stable by state machine sequencing when scan_done gating is enabled
+            row_scan = keys[r*cols.nbits:(r+1)*cols.nbits]
+            # below is in sysclock domain; keys only changes once per scan, so it is stable while scan_done_sys is asserted
             self.sync += If(scan_done_sys, getattr(self, "row" + str(r) + "dat").status.eq(row_scan))\
                          .Else(getattr(self, "row" + str(r) + "dat").status.eq(getattr(self, "row" + str(r) + "dat").status))
 
-            self.sync.kbd += [
-                If(reset_scan,
-                   row_scan.eq(0)
-                ).Else(
-                    If(rows[r] & (colcount[0:2] == 3),  # sample row only on the 4th cycle of colcount
-                       row_scan.eq(row_scan | col_r)
-                    ).Else(
-                        row_scan.eq(row_scan)
-                    )
-                )
-            ]
-
             rowshadow = Signal(cols.nbits)
             self.sync.kbd += If(update_shadow, rowshadow.eq(row_scan)).Else(rowshadow.eq(rowshadow))
 
             setattr(self, "row_scan" + str(r), row_scan)
             setattr(self, "rowshadow" + str(r), rowshadow)
 
-        pending_key = Signal()
-        self.sync.kbd += [
-            If(colcount == (settling*cols.nbits+2),
-               colcount.eq(0),
-            ).Else(
-                colcount.eq(colcount + 1),
-            ),
-
-            If(colcount == (settling*cols.nbits),
-               scan_done.eq(1),
-            ).Else(
-                scan_done.eq(0),
-            ),
-            If(colcount == (settling*cols.nbits+1),
-               update_shadow.eq(~pending_key),  # only update the shadow if the pending bit has been cleared (e.g., CPU has acknowledged it has fetched the current key state)
-            ).Else(
-               update_shadow.eq(0),
-            ),
-            If(colcount == (settling*cols.nbits+2),
-               reset_scan.eq(1),
-            ).Else(
-                reset_scan.eq(0)
-            )
-        ]
-
-        # drive the columns based on the colcount counter
-        self.submodules.coldecoder = Decoder(cols.nbits)
-        self.comb += [
-            self.coldecoder.i.eq(colcount[log2_int(settling):]),
-            self.coldecoder.n.eq(~(colcount < settling*cols.nbits)),
-            cols.eq(self.coldecoder.o)
-        ]
-        self.sync.kbd += col_r.eq(self.coldecoder.o)
-
         self.submodules.ev = EventManager()
         self.ev.keypressed = EventSourcePulse() # rising edge triggered
         self.ev.finalize()
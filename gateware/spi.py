@@ -87,9 +87,22 @@ class SpiMaster(Module, AutoCSR, AutoDoc):
 
         self.specials += MultiReg(self.tip_r, self.status.fields.tip)
 
+        # "active" is meant to gate the "spi" clock: it covers the go pulse, the transaction itself, and a hangover
+        # (also applied out of reset) so the spi domain leaves reset and the slave sees csn rise with the clock running
+        self.active = Signal()
+        hangover = Signal(6, reset=63)
+        self.sync += [
+            If(self.tx_written | self.status.fields.tip,
+               hangover.eq(63),
+            ).Elif(hangover != 0,
+               hangover.eq(hangover - 1),
+            )
+        ]
+
         self.submodules.txwrite = PulseStretch() # stretch the go signal to ensure it's picked up in the SPI domain
         self.comb += self.txwrite.i.eq(self.control.fields.go)
         self.comb += self.tx_written.eq(self.txwrite.o)
+        self.comb += self.active.eq(self.tx_written | self.status.fields.tip | (hangover != 0))
         tx_written_d = Signal()
         tx_go = Signal()
         self.sync.spi += tx_written_d.eq(self.tx_written)
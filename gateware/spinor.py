@@ -3,9 +3,241 @@ from litex.soc.interconnect.csr_eventmanager import *
 from litex.soc.interconnect import wishbone
 from litex.soc.integration.doc import AutoDoc, ModuleDoc
 
+# Bit-serial SPI byte shifter used to issue the status register commands that spimemio can't
+# Runs at 1/2 sysclk; data is shifted out on the falling edge and sampled on the rising edge (mode 0)
+# sclk and mosi come straight from flops, so the flash clock never sees FSM decode glitches
+class SpiByte(Module):
+    def __init__(self):
+        self.start = Signal()
+        self.ready = Signal()
+        self.tx = Signal(8)
+        self.rx = Signal(8)
 
-class SpiNor(Module, AutoCSR):
-    def __init__(self, platform, pads, size=2*1024*1024):
+        self.sclk = Signal()
+        self.mosi = Signal()
+        self.miso = Signal()
+
+        sr = Signal(8)
+        count = Signal(4)
+        self.comb += self.rx.eq(sr)
+
+        fsm = FSM(reset_state="IDLE")
+        self.submodules += fsm
+        fsm.act("IDLE",
+                self.ready.eq(1),
+                If(self.start,
+                   NextValue(sr, self.tx),
+                   NextValue(count, 8),
+                   NextValue(self.mosi, self.tx[7]),
+                   NextState("LOW"),
+                )
+        )
+        fsm.act("LOW",
+                NextValue(self.sclk, 1),
+                NextState("HIGH"),
+        )
+        fsm.act("HIGH",
+                NextValue(self.sclk, 0),
+                NextValue(sr, Cat(self.miso, sr[:7])),
+                NextValue(count, count - 1),
+                If(count == 1,
+                   NextState("IDLE"),
+                ).Else(
+                   NextValue(self.mosi, sr[6]),
+                   NextState("LOW"),
+                )
+        )
+
+# Sets the QE bit in status register 2 (volatile write), then has spimemio switch to quad mode
+# spimemio can't be told to stop, so the handover of the pads is done at points where it is known to be quiet:
+# on the way in, once its flash clock has sat low for `gap` cycles with reads held off (it is parked waiting for
+# the next bus read, CS# still low); on the way out, once the cfgreg write has put its xfer engine in reset (CS# high)
+class SpiQeInit(Module):
+    def __init__(self, qe_init=True, gap=8):
+        self.go = Signal()       # pulse to (re-)run the sequence
+        self.enable = Signal()   # spimemio has finished its reset sequence
+        self.mem_clk = Signal()  # spimemio flash clock and CS#
+        self.mem_csb = Signal()
+        self.miso = Signal()
+
+        self.busy = Signal()     # hold off spimemio reads
+        self.own = Signal()      # the sequencer drives the pads
+        self.cs_n = Signal(reset=1)
+        self.sclk = Signal()
+        self.mosi = Signal()
+        self.cfg_we = Signal()   # write cfgreg byte 2 with quad mode settings
+        self.done = Signal()
+        self.sr2 = Signal(8)
+
+        self.submodules.shift = shift = SpiByte()
+        self.comb += [
+            shift.miso.eq(self.miso),
+            self.sclk.eq(shift.sclk),
+            self.mosi.eq(shift.mosi),
+        ]
+
+        # gap is the CS# deselect time between commands, must exceed tSHSL (50ns) at 100MHz sysclk
+        count = Signal(max=gap+1)
+        cs = Signal()
+        # registered like shift.sclk/shift.mosi, so CS# falls one cycle ahead of the first clock edge
+        self.sync += self.cs_n.eq(~cs)
+        req = Signal(reset=int(qe_init))
+
+        fsm = FSM(reset_state="IDLE")
+        self.submodules += fsm
+        fsm.act("IDLE",
+            If(self.go,
+               NextValue(req, 1),
+            ),
+            If((req | self.go) & self.enable,
+               NextValue(req, 0),
+               NextValue(self.done, 0),
+               NextValue(count, 0),
+               NextState("PARK"),
+            )
+        )
+        # reads are held off from here on; wait for spimemio to finish the word it's on and park
+        fsm.act("PARK",
+            self.busy.eq(1),
+            If(self.mem_clk,
+               NextValue(count, 0),
+            ).Elif(count == gap,
+               NextValue(self.own, 1),
+               NextValue(count, gap),
+               NextState("DESELECT"),
+            ).Else(
+               NextValue(count, count + 1),
+            )
+        )
+        # spimemio left CS# low; close that transaction before the first command
+        fsm.act("DESELECT",
+            self.busy.eq(1),
+            NextValue(count, count - 1),
+            If(count == 0,
+               NextState("WEL"),
+            )
+        )
+        # 0x50: write enable for volatile status register
+        fsm.act("WEL",
+            self.busy.eq(1), cs.eq(1),
+            shift.tx.eq(0x50),
+            If(shift.ready,
+               shift.start.eq(1),
+               NextState("WEL_WAIT"),
+            )
+        )
+        fsm.act("WEL_WAIT",
+            self.busy.eq(1), cs.eq(1),
+            If(shift.ready,
+               NextValue(count, gap),
+               NextState("WEL_GAP"),
+            )
+        )
+        fsm.act("WEL_GAP",
+            self.busy.eq(1),
+            NextValue(count, count - 1),
+            If(count == 0,
+               NextState("RDSR2"),
+            )
+        )
+        # 0x35: read status register 2
+        fsm.act("RDSR2",
+            self.busy.eq(1), cs.eq(1),
+            shift.tx.eq(0x35),
+            If(shift.ready,
+               shift.start.eq(1),
+               NextState("RDSR2_CMD"),
+            )
+        )
+        fsm.act("RDSR2_CMD",
+            self.busy.eq(1), cs.eq(1),
+            shift.tx.eq(0x00),
+            If(shift.ready,
+               shift.start.eq(1),
+               NextState("RDSR2_DAT"),
+            )
+        )
+        fsm.act("RDSR2_DAT",
+            self.busy.eq(1), cs.eq(1),
+            If(shift.ready,
+               NextValue(self.sr2, shift.rx),
+               NextValue(count, gap),
+               NextState("RDSR2_GAP"),
+            )
+        )
+        fsm.act("RDSR2_GAP",
+            self.busy.eq(1),
+            NextValue(count, count - 1),
+            If(count == 0,
+               NextState("WRSR2"),
+            )
+        )
+        # 0x31: write status register 2 with QE (bit 1) set
+        fsm.act("WRSR2",
+            self.busy.eq(1), cs.eq(1),
+            shift.tx.eq(0x31),
+            If(shift.ready,
+               shift.start.eq(1),
+               NextState("WRSR2_CMD"),
+            )
+        )
+        fsm.act("WRSR2_CMD",
+            self.busy.eq(1), cs.eq(1),
+            shift.tx.eq(self.sr2 | 0x02),
+            If(shift.ready,
+               shift.start.eq(1),
+               NextState("WRSR2_DAT"),
+            )
+        )
+        fsm.act("WRSR2_DAT",
+            self.busy.eq(1), cs.eq(1),
+            If(shift.ready,
+               NextValue(count, gap),
+               NextState("WRSR2_GAP"),
+            )
+        )
+        # tSHSL2 wait before the next command
+        fsm.act("WRSR2_GAP",
+            self.busy.eq(1),
+            NextValue(count, count - 1),
+            If(count == 0,
+               NextState("QUAD"),
+            )
+        )
+        # put spimemio into quad mode: cfgreg[21] = qspi, cfgreg[19:16] = 4 dummy cycles for 0xEB
+        # the write also soft-resets spimemio, which then re-runs its reset sequence in quad mode
+        fsm.act("QUAD",
+            self.busy.eq(1),
+            self.cfg_we.eq(1),
+            NextState("HANDBACK"),
+        )
+        # hand the pads back once spimemio's xfer engine is in reset (CS# high, clock low)
+        fsm.act("HANDBACK",
+            self.busy.eq(1),
+            If(self.mem_csb,
+               NextValue(self.own, 0),
+               NextValue(self.done, 1),
+               NextState("IDLE"),
+            )
+        )
+
+class SpiNor(Module, AutoCSR, AutoDoc):
+    def __init__(self, platform, pads, size=2*1024*1024, width=1, qe_init=False):
+        self.intro = ModuleDoc("""SpiNor - memory-mapped SPI flash read port
+
+        Wraps spimemio. When `width` is 4, the controller is wired to all four DQ lines and, once spimemio
+        has finished its reset/wake-up sequence and completed its first read, an init sequencer sets the QE bit
+        in status register 2 using a volatile write (0x50 write-enable-volatile, 0x35 read SR2, 0x31 write SR2
+        with bit 1 set), then switches spimemio into Quad I/O Fast Read (0xEB) mode. While the sequencer runs,
+        bus reads are stalled (not dropped): it waits for spimemio to go quiet, deselects the flash, issues its
+        commands, and hands the pads back once the mode switch has reset spimemio.
+
+        The sequence is Winbond (W25Q) specific: on Micron parts such as the N25Q/MT25Q there is no QE bit in
+        an SR2, and 0x35 enters the quad I/O protocol instead, which breaks the 0xEB reads that follow. It
+        therefore only runs at reset when built with `qe_init=True`; otherwise (e.g. QE fixed at the factory)
+        firmware sets quad mode via `cfg3` directly. On a W25Q part the sequence can also be run at any time
+        by writing `1` to the `go` field of `qe_ctl`.
+        """)
         if isinstance(platform.toolchain, XilinxVivadoToolchain):
             # instantiate Artix clock access
             artix_clk = Signal()
@@ -33,8 +265,6 @@ class SpiNor(Module, AutoCSR):
         cfg_we = Signal(4)
         cfg_out = Signal(32)
         self.comb += [
-            cfg.eq(Cat(self.cfg1.storage, self.cfg2.storage, self.cfg3.storage, self.cfg4.storage)),
-            cfg_we.eq(Cat(self.cfg1.re, self.cfg2.re, self.cfg3.re, self.cfg4.re)),
             self.stat1.status.eq(cfg_out[0:8]),
             self.stat2.status.eq(cfg_out[8:16]),
             self.stat3.status.eq(cfg_out[16:24]),
@@ -48,13 +278,19 @@ class SpiNor(Module, AutoCSR):
             clk_pad  = TSTriple()
         wp_pad   = TSTriple()
         hold_pad = TSTriple()
-        self.specials += mosi_pad.get_tristate(pads.mosi)
-        self.specials += miso_pad.get_tristate(pads.miso)
+        if width == 4:
+            self.specials += mosi_pad.get_tristate(pads.dq[0])
+            self.specials += miso_pad.get_tristate(pads.dq[1])
+            self.specials += wp_pad.get_tristate(pads.dq[2])
+            self.specials += hold_pad.get_tristate(pads.dq[3])
+        else:
+            self.specials += mosi_pad.get_tristate(pads.mosi)
+            self.specials += miso_pad.get_tristate(pads.miso)
+            self.specials += wp_pad.get_tristate(pads.wp)
+            self.specials += hold_pad.get_tristate(pads.hold)
         self.specials += cs_n_pad.get_tristate(pads.cs_n)
         if isinstance(platform.toolchain, XilinxVivadoToolchain) == False:
             self.specials += clk_pad.get_tristate(pads.clk)
-        self.specials += wp_pad.get_tristate(pads.wp)
-        self.specials += hold_pad.get_tristate(pads.hold)
 
         reset = Signal()
         self.comb += [
@@ -70,10 +306,65 @@ class SpiNor(Module, AutoCSR):
         pad = Signal(2)
         self.comb += flash_addr.eq(Cat(pad, bus.adr[0:mem_bits-1]))
 
+        # QE init sequencer; while qe_own, the pads are driven by the sequencer and not by spimemio
+        qe_busy = Signal()    # hold off spimemio reads
+        qe_own = Signal()
+        qe_cfg_we = Signal()
+        instance_clk = Signal()
+        csb = Signal()
+        if width == 4:
+            self.qe_ctl = CSRStorage(fields=[
+                CSRField("go", description="Write `1` to (re-)run the QE bit init sequence and switch to quad mode", pulse=True),
+            ])
+            self.qe_stat = CSRStatus(fields=[
+                CSRField("done", description="Set when the QE init sequence has completed"),
+                CSRField("sr2", size=8, description="Value of status register 2 as read during the QE init sequence"),
+            ])
+            self.submodules.qe = qe = SpiQeInit(qe_init=qe_init)
+
+            # spimemio runs its own reset sequence (0xFF to exit continuous mode, 0xAB to leave deep power-down)
+            # before it acks the first read; waiting for that also absorbs the first USRCCLKO cycles that
+            # STARTUPE2 drops after configuration
+            first_ack = Signal()
+            self.sync += If(bus.ack, first_ack.eq(1))
+
+            self.comb += [
+                qe.go.eq(self.qe_ctl.fields.go),
+                qe.enable.eq(first_ack),
+                qe.mem_clk.eq(instance_clk),
+                qe.mem_csb.eq(csb),
+                qe.miso.eq(miso_pad.i),
+                self.qe_stat.fields.done.eq(qe.done),
+                self.qe_stat.fields.sr2.eq(qe.sr2),
+                qe_busy.eq(qe.busy),
+                qe_own.eq(qe.own),
+                qe_cfg_we.eq(qe.cfg_we),
+                If(qe_own,
+                   mosi_pad.oe.eq(1),
+                   mosi_pad.o.eq(qe.mosi),
+                   miso_pad.oe.eq(0),
+                   wp_pad.oe.eq(1),
+                   wp_pad.o.eq(1),
+                   hold_pad.oe.eq(1),
+                   hold_pad.o.eq(1),
+                   cs_n_pad.o.eq(qe.cs_n),
+                )
+            ]
+
+        self.comb += [
+            If(qe_cfg_we,
+               cfg.eq(Cat(self.cfg1.storage, self.cfg2.storage, Constant(0x24, 8), self.cfg4.storage)),
+               cfg_we.eq(0b0100),
+            ).Else(
+               cfg.eq(Cat(self.cfg1.storage, self.cfg2.storage, self.cfg3.storage, self.cfg4.storage)),
+               cfg_we.eq(Cat(self.cfg1.re, self.cfg2.re, self.cfg3.re, self.cfg4.re)),
+            )
+        ]
+
         read_active = Signal()
         spi_ready = Signal()
         self.sync += [
-            If(bus.stb & bus.cyc & ~read_active,
+            If(bus.stb & bus.cyc & ~read_active & ~qe_busy,
                 read_active.eq(1),
                 bus.ack.eq(0),
             )
@@ -90,22 +381,44 @@ class SpiNor(Module, AutoCSR):
         o_rdata = Signal(32)
         self.comb += bus.dat_r.eq(o_rdata)
 
-        instance_clk = Signal()
+        flash_clk = Signal()
+        if width == 4:
+            # both clock sources and the select are flop outputs; SpiQeInit only flips qe_own while spimemio is
+            # parked or held in reset with its clock low, and its own sclk is low
+            self.comb += If(qe_own, flash_clk.eq(self.qe.sclk)).Else(flash_clk.eq(instance_clk))
+        else:
+            self.comb += flash_clk.eq(instance_clk)
         if isinstance(platform.toolchain, XilinxVivadoToolchain):
-            self.comb += artix_clk.eq(instance_clk)
+            self.comb += artix_clk.eq(flash_clk)
         else:
-            self.comb += clk_pad.o.eq(instance_clk)
+            self.comb += clk_pad.o.eq(flash_clk)
+
+        io_oe = Signal(4)
+        io_do = Signal(4)
+        self.comb += [
+            If(~qe_own,
+               mosi_pad.oe.eq(io_oe[0]),
+               miso_pad.oe.eq(io_oe[1]),
+               wp_pad.oe.eq(io_oe[2]),
+               hold_pad.oe.eq(io_oe[3]),
+               mosi_pad.o.eq(io_do[0]),
+               miso_pad.o.eq(io_do[1]),
+               wp_pad.o.eq(io_do[2]),
+               hold_pad.o.eq(io_do[3]),
+               cs_n_pad.o.eq(csb),
+            )
+        ]
         self.specials += Instance("spimemio",
-            o_flash_io0_oe = mosi_pad.oe,
-            o_flash_io1_oe = miso_pad.oe,
-            o_flash_io2_oe = wp_pad.oe,
-            o_flash_io3_oe = hold_pad.oe,
-
-            o_flash_io0_do = mosi_pad.o,
-            o_flash_io1_do = miso_pad.o,
-            o_flash_io2_do = wp_pad.o,
-            o_flash_io3_do = hold_pad.o,
-            o_flash_csb    = cs_n_pad.o,
+            o_flash_io0_oe = io_oe[0],
+            o_flash_io1_oe = io_oe[1],
+            o_flash_io2_oe = io_oe[2],
+            o_flash_io3_oe = io_oe[3],
+
+            o_flash_io0_do = io_do[0],
+            o_flash_io1_do = io_do[1],
+            o_flash_io2_do = io_do[2],
+            o_flash_io3_do = io_do[3],
+            o_flash_csb    = csb,
             o_flash_clk    = instance_clk,
 
             i_flash_io0_di = mosi_pad.i,
@@ -116,7 +429,7 @@ class SpiNor(Module, AutoCSR):
             i_resetn = ~reset,
             i_clk = ClockSignal(),
 
-            i_valid = bus.stb & bus.cyc,
+            i_valid = bus.stb & bus.cyc & ~qe_busy,
             o_ready = spi_ready,
             i_addr  = flash_addr,
             o_rdata = o_rdata,
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import lxbuildenv_sim
+
+# This variable defines all the external programs that this module
+# relies on.  lxbuildenv reads this variable in order to ensure
+# the build will finish without exiting due to missing third-party
+# programs.
+LX_DEPENDENCIES = []
+
+import os
+import sys
+# print('\n'.join(sys.path))  # help with debugging PYTHONPATH issues
+
+from migen import *
+from migen.sim import passive
+
+from gateware.spinor import SpiQeInit
+
+# Checks the SpiQeInit handover and command framing against a behavioral model of spimemio and the flash.
+# This is a pure migen run_simulation testbench (spimemio itself is Verilog and isn't part of it), so unlike
+# the other sims it doesn't need Vivado.
+
+SR2 = 0x40  # some other bit set in SR2, so the sequencer has to preserve it
+MIN_GAP = 5 # tSHSL (50ns) at 100MHz
+
+# stands in for spimemio's pad outputs: runs its reset sequence, keeps prefetching until reads are held off,
+# then parks with CS# low (as it does in state 12); the cfgreg write resets it and it starts over
+def spimemio_model(dut, log):
+    yield dut.mem_csb.eq(1)
+    for _ in range(10):
+        yield
+    yield dut.mem_csb.eq(0)
+    yield dut.enable.eq(1)
+    while True:
+        busy = yield dut.busy
+        for i in range(16):
+            yield dut.mem_clk.eq(i % 2 == 0)
+            yield
+        yield dut.mem_clk.eq(0)
+        yield
+        if busy:
+            break
+    while not (yield dut.cfg_we):
+        yield
+    # softreset lands two cycles after cfgreg_we, the xfer engine comes out of reset a cycle later
+    yield
+    yield
+    yield dut.mem_csb.eq(1)
+    yield
+    yield dut.mem_csb.eq(0)
+    for i in range(32):
+        yield
+        yield dut.mem_clk.eq(i % 2 == 0)
+    yield dut.mem_clk.eq(0)
+    for _ in range(20):
+        yield
+    log["done"] = yield dut.done
+    log["sr2"] = yield dut.sr2
+
+# the flash as seen from the pads: records every CS#-low transaction and answers 0x35 with SR2
+@passive
+def flash_model(dut, log):
+    prev_cs_n = 1
+    prev_clk = 0
+    prev_own = 0
+    high_for = 0
+    txn = None
+    while True:
+        own = yield dut.own
+        if own:
+            cs_n = yield dut.cs_n
+            clk = yield dut.sclk
+        else:
+            cs_n = yield dut.mem_csb
+            clk = yield dut.mem_clk
+        mosi = yield dut.mosi
+
+        if own != prev_own:
+            # both clocks must be low on either side of the mux switch
+            sclk = yield dut.sclk
+            mem_clk = yield dut.mem_clk
+            if prev_clk or sclk or mem_clk:
+                log["glitch"].append("clock mux switched with a clock high")
+            log["switches"].append(own)
+
+        if cs_n:
+            if not prev_cs_n:
+                log["txns"].append(txn)
+                txn = None
+            high_for += 1
+        else:
+            if prev_cs_n:
+                txn = {"own": own, "gap": high_for, "bits": [], "bytes": []}
+                high_for = 0
+            if clk and not prev_clk:
+                txn["bits"].append(mosi)
+                if len(txn["bits"]) % 8 == 0:
+                    byte = 0
+                    for b in txn["bits"][-8:]:
+                        byte = (byte << 1) | b
+                    txn["bytes"].append(byte)
+            if not clk and prev_clk and txn["bytes"][:1] == [0x35] and len(txn["bits"]) >= 8:
+                n = len(txn["bits"]) - 8
+                if n < 8:
+                    yield dut.miso.eq((SR2 >> (7 - n)) & 1)
+
+        if (yield dut.cfg_we):
+            log["cfg_we"].append(len(log["txns"]))
+        prev_cs_n = cs_n
+        prev_clk = clk
+        prev_own = own
+        yield
+
+
+def check(dut, log):
+    seq = [t for t in log["txns"] if t["own"]]
+    assert not log["glitch"], log["glitch"]
+    assert log["switches"] == [1, 0], log["switches"]
+    assert [t["bytes"] for t in seq] == [[0x50], [0x35, 0x00], [0x31, SR2 | 0x02]], [t["bytes"] for t in seq]
+    for t in seq:
+        assert len(t["bits"]) % 8 == 0, t
+        assert t["gap"] >= MIN_GAP, t
+    # the sequencer's first command must open a new transaction after spimemio's was closed
+    assert log["txns"][-len(seq) - 1]["own"] == 0
+    assert log["cfg_we"] == [len(log["txns"])], log["cfg_we"]
+    assert log["done"] == 1 and log["sr2"] == SR2, (log["done"], log["sr2"])
+
+
+def main():
+    dut = SpiQeInit(qe_init=True)
+    log = {"txns": [], "switches": [], "glitch": [], "cfg_we": []}
+    os.system("mkdir -p run")
+    run_simulation(dut, [spimemio_model(dut, log), flash_model(dut, log)], vcd_name="run/sim_spinor.vcd")
+    check(dut, log)
+    print("SpiQeInit: {} commands framed correctly, handover clean".format(len([t for t in log["txns"] if t["own"]])))
+
+
+if __name__ == "__main__":
+    main()